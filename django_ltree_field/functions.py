@@ -88,3 +88,21 @@ class Concat(Func):
         if len(expressions) < 2:
             raise ValueError('Concat takes at least 2 arguments')
         super().__init__(*expressions, **extra)
+
+
+class Insert(Concat):
+    """
+    Insert a label (or path) into an ltree path before the label at the given position.
+    Shorthand for Concat(Subpath(path, 0, position), label, Subpath(path, position)).
+    Position counts from 0, and a negative position counts from the end of the path, so
+    -nlevel(path) <= position < nlevel(path). Postgres raises "invalid positions" otherwise,
+    including for position == nlevel(path), so use Concat to append a label to the end instead.
+    Like the other functions, strings are treated as field references, so wrap a literal label in Value().
+    """
+    def __init__(self, expression, position, label, **extra):
+        super().__init__(
+            Subpath(expression, 0, position),
+            label,
+            Subpath(expression, position),
+            **extra
+        )
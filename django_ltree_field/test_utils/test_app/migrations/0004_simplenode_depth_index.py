@@ -0,0 +1,18 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('test_app', '0003_auto_20210330_0308'),
+    ]
+
+    # Expression index matching the SQL emitted by the depth transform, so depth lookups
+    # can be satisfied by an index probe
+    # Functional indexes can't be declared on Meta until Django 3.2
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX test_app_simplenode_depth_idx ON test_app_simplenode (nlevel(path))',
+            reverse_sql='DROP INDEX test_app_simplenode_depth_idx',
+        ),
+    ]
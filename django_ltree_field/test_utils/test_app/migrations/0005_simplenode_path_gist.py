@@ -0,0 +1,16 @@
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('test_app', '0004_simplenode_depth_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='simplenode',
+            index=django.contrib.postgres.indexes.GistIndex(fields=['path'], name='simplenode_path_gist'),
+        ),
+    ]
@@ -1,3 +1,4 @@
+from django.contrib.postgres.indexes import GistIndex
 from django.db import models
 
 from django_ltree_field.fields import LTreeField
@@ -9,6 +10,10 @@ class SimpleNode(models.Model):
 
     class Meta:
         ordering = ['path']
+        indexes = [
+            # Accelerates the ancestor_of, descendant_of, matches, and search lookups
+            GistIndex(fields=['path'], name='simplenode_path_gist'),
+        ]
 
     def __str__(self):
         return '.'.join(self.path)
@@ -1,4 +1,5 @@
 #!/usr/bin/env -S python -Wall
+import argparse
 import os
 import sys
 
@@ -8,14 +9,23 @@ from django.test.utils import get_runner
 
 
 def run_tests(*test_args):
-    if not test_args:
-        test_args = ['tests']
-
     os.environ['DJANGO_SETTINGS_MODULE'] = 'tests.settings'
     django.setup()
     TestRunner = get_runner(settings)
-    test_runner = TestRunner()
-    failures = test_runner.run_tests(test_args)
+
+    # Accept the same options as "manage.py test", e.g. --parallel and --keepdb
+    # The runner only adds its own options; these three come from the management command
+    parser = argparse.ArgumentParser()
+    parser.add_argument('test_labels', nargs='*', default=['tests'])
+    parser.add_argument('-v', '--verbosity', type=int, choices=[0, 1, 2, 3], default=1)
+    parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive')
+    parser.add_argument('--failfast', action='store_true')
+    TestRunner.add_arguments(parser)
+    options = vars(parser.parse_args(test_args))
+    test_labels = options.pop('test_labels')
+
+    test_runner = TestRunner(**options)
+    failures = test_runner.run_tests(test_labels)
     sys.exit(bool(failures))
 
 
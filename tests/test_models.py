@@ -8,158 +8,206 @@ test_django_tree_field
 Tests for `django_ltree_field` models module.
 """
 
+from django.db import connection
 from django.db.models import Value, Q
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase
 
-from django_ltree_field.functions import Concat, Subpath
+from django_ltree_field.fields import IndexTransform, LTreeField, SliceTransform
+from django_ltree_field.functions import Concat, Insert, Subpath
 from django_ltree_field.test_utils.test_app.models import SimpleNode
 
 
+# Example fixture from the postgres documentation
+PATHS = (
+    'Top', 'Top.Science', 'Top.Science.Astronomy', 'Top.Science.Astronomy.Astrophysics',
+    'Top.Science.Astronomy.Cosmology', 'Top.Hobbies', 'Top.Hobbies.Amateurs_Astronomy',
+    'Top.Collections', 'Top.Collections.Pictures', 'Top.Collections.Pictures.Astronomy',
+    'Top.Collections.Pictures.Astronomy.Stars', 'Top.Collections.Pictures.Astronomy.Galaxies',
+    'Top.Collections.Pictures.Astronomy.Astronauts'
+)
+
+# Expected results, as dotted paths
+# The second level of the tree is the answer for several lookups
+TOP_LEVEL = (
+    'Top.Collections',
+    'Top.Hobbies',
+    'Top.Science'
+)
+
+EXPECTED_ANCESTOR_OF = (
+    'Top',
+    'Top.Collections',
+    'Top.Collections.Pictures'
+)
+
+# The two "Astronomy" subtrees show up in several results
+SCIENCE_ASTRONOMY = (
+    'Top.Science.Astronomy',
+    'Top.Science.Astronomy.Astrophysics',
+    'Top.Science.Astronomy.Cosmology'
+)
+
+PICTURES_ASTRONOMY = 'Top.Collections.Pictures.Astronomy'
+PICTURES_ASTRONOMY_SUBTREE = (PICTURES_ASTRONOMY,) + tuple(
+    f'{PICTURES_ASTRONOMY}.{label}' for label in ('Astronauts', 'Galaxies', 'Stars')
+)
+
+EXPECTED_DESCENDANT_OF = ('Top.Science',) + SCIENCE_ASTRONOMY
+
+EXPECTED_MATCHES = PICTURES_ASTRONOMY_SUBTREE + SCIENCE_ASTRONOMY
+
+EXPECTED_SEARCH = ('Top.Hobbies.Amateurs_Astronomy',) + SCIENCE_ASTRONOMY
+
+EXPECTED_PATH_CONSTRUCTION = (
+    'Top.Science.Space.Astronomy',
+    'Top.Science.Space.Astronomy.Astrophysics',
+    'Top.Science.Space.Astronomy.Cosmology'
+)
+
+
 class TestSimpleNode(TestCase):
+    # The lookups return sets of nodes, so results are compared without ordering
+    # Clearing the model's default ordering leaves the planner free to skip the sort
+    # Each lookup should compile to exactly one query
+
     # TODO
     # test_parent_of
-    # test_index
     # test_slice
     # test_lca (both array args and variadic args)
     # test other functions
 
-    def setUp(self):
-        # Bulk create the example fixture
-        PATHS = [
-            'Top', 'Top.Science', 'Top.Science.Astronomy', 'Top.Science.Astronomy.Astrophysics',
-            'Top.Science.Astronomy.Cosmology', 'Top.Hobbies', 'Top.Hobbies.Amateurs_Astronomy',
-            'Top.Collections', 'Top.Collections.Pictures', 'Top.Collections.Pictures.Astronomy',
-            'Top.Collections.Pictures.Astronomy.Stars', 'Top.Collections.Pictures.Astronomy.Galaxies',
-            'Top.Collections.Pictures.Astronomy.Astronauts'
-        ]
-
+    @classmethod
+    def setUpTestData(cls):
+        # Bulk create the example fixture once for the whole class
+        # None of the tests modify it, so there's no need to rebuild it per test
         SimpleNode.objects.bulk_create(
-            SimpleNode(path=path) for path in PATHS
+            [SimpleNode(path=path) for path in PATHS]
         )
 
     def test_depth(self):
+        # Make sure transformer "values" works, for every node in a single query
+        with self.assertNumQueries(1):
+            depths = {
+                '.'.join(path): depth
+                for path, depth in SimpleNode.objects.order_by().values_list('path', 'path__depth')
+            }
+
+        self.assertEqual(depths, {path: path.count('.') + 1 for path in PATHS})
+
         # Make sure lookup works
-        self.assertSequenceEqual(
-            [
-                ['Top', 'Collections'],
-                ['Top', 'Hobbies'],
-                ['Top', 'Science']
-            ],
-            SimpleNode.objects.filter(
-                path__depth=2
-            ).values_list('path', flat=True)
-        )
+        with self.assertNumQueries(1):
+            self.assertQuerysetEqual(
+                SimpleNode.objects.filter(path__depth=2).order_by().values_list('path', flat=True),
+                TOP_LEVEL,
+                transform='.'.join,
+                ordered=False
+            )
+
+    def test_index(self):
+        # Every path starts with "Top", so also read a label past the root
+        # subltree() raises for an index past the end of the path, so skip the root node
+        with self.assertNumQueries(1):
+            labels = {
+                '.'.join(path): (first, second)
+                for path, first, second in SimpleNode.objects.filter(
+                    path__depth__gte=2
+                ).order_by().values_list('path', 'path__0', 'path__1')
+            }
 
-        # Make sure transformer "values" works
         self.assertEqual(
-            SimpleNode.objects.filter(path='Top.Collections.Pictures.Astronomy').values_list(
-                'path__depth', flat=True
-            )[0],
-            4
+            labels,
+            {path: tuple(path.split('.')[:2]) for path in PATHS if path.count('.') >= 1}
         )
 
     def test_sibling_of(self):
-        self.assertSequenceEqual(
-            [
-                ['Top', 'Collections'],
-                ['Top', 'Hobbies'],
-                ['Top', 'Science']
-            ],
-            SimpleNode.objects.filter(path__sibling_of='Top.Science').values_list('path', flat=True)
-        )
+        with self.assertNumQueries(1):
+            self.assertQuerysetEqual(
+                SimpleNode.objects.filter(path__sibling_of='Top.Science').order_by().values_list('path', flat=True),
+                TOP_LEVEL,
+                transform='.'.join,
+                ordered=False
+            )
 
     def test_child_of(self):
-        self.assertSequenceEqual(
-            [
-                ['Top', 'Collections'],
-                ['Top', 'Hobbies'],
-                ['Top', 'Science']
-            ],
-            SimpleNode.objects.filter(path__child_of='Top').values_list('path', flat=True)
-        )
+        with self.assertNumQueries(1):
+            self.assertQuerysetEqual(
+                SimpleNode.objects.filter(path__child_of='Top').order_by().values_list('path', flat=True),
+                TOP_LEVEL,
+                transform='.'.join,
+                ordered=False
+            )
 
     def test_ancestor_of(self):
-        self.assertSequenceEqual(
-            [
-                ['Top'],
-                ['Top', 'Collections'],
-                ['Top', 'Collections', 'Pictures']
-            ],
-            SimpleNode.objects.filter(path__ancestor_of='Top.Collections.Pictures').values_list('path', flat=True)
-        )
+        with self.assertNumQueries(1):
+            self.assertQuerysetEqual(
+                SimpleNode.objects.filter(
+                    path__ancestor_of='Top.Collections.Pictures'
+                ).order_by().values_list('path', flat=True),
+                EXPECTED_ANCESTOR_OF,
+                transform='.'.join,
+                ordered=False
+            )
 
     def test_strict_descendant_of(self):
         # We could make this a __strict_descendant_of lookup or something, but
         # that's a little strange
-        self.assertSequenceEqual(
-            [
-                ['Top', 'Science', 'Astronomy'],
-                ['Top', 'Science', 'Astronomy', 'Astrophysics'],
-                ['Top', 'Science', 'Astronomy', 'Cosmology']
-            ],
-            SimpleNode.objects.filter(
-                ~Q(path='Top.Science')
-                & Q(path__descendant_of='Top.Science')
-            ).values_list('path', flat=True)
-        )
+        with self.assertNumQueries(1):
+            self.assertQuerysetEqual(
+                SimpleNode.objects.filter(
+                    ~Q(path='Top.Science')
+                    & Q(path__descendant_of='Top.Science')
+                ).order_by().values_list('path', flat=True),
+                SCIENCE_ASTRONOMY,
+                transform='.'.join,
+                ordered=False
+            )
 
     # The following tests runs through all the examples from the postgres documentation, listed
     # here: https://www.postgresql.org/docs/9.1/ltree.html#AEN141210
 
     # The postgres docs call this "inheritance", but we usually call it "is_descendant"
     def test_descendant_of(self):
-        self.assertSequenceEqual(
-            [
-                ['Top', 'Science'],
-                ['Top', 'Science', 'Astronomy'],
-                ['Top', 'Science', 'Astronomy', 'Astrophysics'],
-                ['Top', 'Science', 'Astronomy', 'Cosmology']
-            ],
-            SimpleNode.objects.filter(path__descendant_of='Top.Science').values_list('path', flat=True)
-        )
+        with self.assertNumQueries(1):
+            self.assertQuerysetEqual(
+                SimpleNode.objects.filter(path__descendant_of='Top.Science').order_by().values_list('path', flat=True),
+                EXPECTED_DESCENDANT_OF,
+                transform='.'.join,
+                ordered=False
+            )
 
     def test_pattern_matching(self):
-        self.assertSequenceEqual(
-            [
-                ['Top', 'Collections', 'Pictures', 'Astronomy'],
-                ['Top', 'Collections', 'Pictures', 'Astronomy', 'Astronauts'],
-                ['Top', 'Collections', 'Pictures', 'Astronomy', 'Galaxies'],
-                ['Top', 'Collections', 'Pictures', 'Astronomy', 'Stars'],
-                ['Top', 'Science', 'Astronomy'],
-                ['Top', 'Science', 'Astronomy', 'Astrophysics'],
-                ['Top', 'Science', 'Astronomy', 'Cosmology']
-            ],
-            SimpleNode.objects.filter(path__matches='*.Astronomy.*').values_list('path', flat=True)
-        )
+        with self.assertNumQueries(1):
+            self.assertQuerysetEqual(
+                SimpleNode.objects.filter(path__matches='*.Astronomy.*').order_by().values_list('path', flat=True),
+                EXPECTED_MATCHES,
+                transform='.'.join,
+                ordered=False
+            )
 
-        self.assertSequenceEqual(
-            [
-                ['Top', 'Science', 'Astronomy'],
-                ['Top', 'Science', 'Astronomy', 'Astrophysics'],
-                ['Top', 'Science', 'Astronomy', 'Cosmology']
-            ],
-            SimpleNode.objects.filter(path__matches='*.!pictures@.Astronomy.*').values_list('path', flat=True)
-        )
+        with self.assertNumQueries(1):
+            self.assertQuerysetEqual(
+                SimpleNode.objects.filter(path__matches='*.!pictures@.Astronomy.*').order_by().values_list('path', flat=True),
+                SCIENCE_ASTRONOMY,
+                transform='.'.join,
+                ordered=False
+            )
 
     def test_search(self):
-        self.assertSequenceEqual(
-            [
-                ['Top', 'Hobbies', 'Amateurs_Astronomy'],
-                ['Top', 'Science', 'Astronomy'],
-                ['Top', 'Science', 'Astronomy', 'Astrophysics'],
-                ['Top', 'Science', 'Astronomy', 'Cosmology']
-            ],
-            SimpleNode.objects.filter(path__search='Astro*% & !pictures@').values_list('path', flat=True)
-        )
+        with self.assertNumQueries(1):
+            self.assertQuerysetEqual(
+                SimpleNode.objects.filter(path__search='Astro*% & !pictures@').order_by().values_list('path', flat=True),
+                EXPECTED_SEARCH,
+                transform='.'.join,
+                ordered=False
+            )
 
-        self.assertSequenceEqual(
-            [
-                ['Top', 'Science', 'Astronomy'],
-                ['Top', 'Science', 'Astronomy', 'Astrophysics'],
-                ['Top', 'Science', 'Astronomy', 'Cosmology']
-            ],
-            SimpleNode.objects.filter(path__search='Astro* & !pictures@').values_list('path', flat=True)
-        )
+        with self.assertNumQueries(1):
+            self.assertQuerysetEqual(
+                SimpleNode.objects.filter(path__search='Astro* & !pictures@').order_by().values_list('path', flat=True),
+                SCIENCE_ASTRONOMY,
+                transform='.'.join,
+                ordered=False
+            )
 
     # Also tests out our Concat and Subpath functions
     def test_path_construction(self):
@@ -175,14 +223,104 @@ class TestSimpleNode(TestCase):
             path__descendant_of='Top.Science.Astronomy'
         )
 
-        self.assertSequenceEqual(
-            [
-                ['Top', 'Science', 'Space', 'Astronomy'],
-                ['Top', 'Science', 'Space', 'Astronomy', 'Astrophysics'],
-                ['Top', 'Science', 'Space', 'Astronomy', 'Cosmology']
-            ],
-            queryset.values_list('new_path', flat=True)
+        with self.assertNumQueries(1):
+            self.assertQuerysetEqual(
+                queryset.order_by().values_list('new_path', flat=True),
+                EXPECTED_PATH_CONSTRUCTION,
+                transform='.'.join,
+                ordered=False
+            )
+
+    def test_insert(self):
+        # Same as test_path_construction, using the shorthand
+        queryset = SimpleNode.objects.annotate(
+            new_path=Insert('path', 2, Value('Space'))
+        ).filter(
+            path__descendant_of='Top.Science.Astronomy'
+        )
+
+        queryset = queryset.order_by().values_list('new_path', flat=True)
+
+        # Renders as a single operator chain
+        # Compile the query rather than using str(), which pastes the params in unquoted
+        sql, params = queryset.query.get_compiler(connection=connection).as_sql()
+        column = '"test_app_simplenode"."path"'
+        self.assertIn(
+            'subpath(%s, %%s, %%s) || %%s || subpath(%s, %%s)' % (column, column),
+            sql
         )
+        self.assertEqual(params, (0, 2, 'Space', 2, 'Top.Science.Astronomy'))
+
+        with self.assertNumQueries(1):
+            self.assertQuerysetEqual(
+                queryset,
+                EXPECTED_PATH_CONSTRUCTION,
+                transform='.'.join,
+                ordered=False
+            )
+
+    def test_insert_edge_positions(self):
+        for position, expected in [
+            # Prepend
+            (0, 'Space.Top.Science.Astronomy'),
+            # Counts from the end, so this goes before the last label
+            (-1, 'Top.Science.Space.Astronomy'),
+            (-3, 'Space.Top.Science.Astronomy'),
+        ]:
+            with self.subTest(position=position), self.assertNumQueries(1):
+                self.assertEqual(
+                    '.'.join(SimpleNode.objects.filter(path='Top.Science.Astronomy').values_list(
+                        Insert('path', position, Value('Space')), flat=True
+                    ).get()),
+                    expected
+                )
+
+
+class TestIndexUsage(TestCase):
+    # The ltree operators are only fast if they can use the GiST index on the path column
+
+    def test_gist_index_used(self):
+        with connection.cursor() as cursor:
+            # The table is tiny, so the planner would always pick a sequential scan otherwise
+            # SET LOCAL only lasts until the test's transaction is rolled back
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+        for lookup, value in [
+            ('ancestor_of', 'Top.Science'),
+            ('descendant_of', 'Top.Science'),
+            ('matches', '*.Astronomy.*'),
+            ('search', 'Astro*'),
+        ]:
+            with self.subTest(lookup=lookup):
+                # Clear the default ordering so the btree index isn't picked to avoid a sort
+                plan = SimpleNode.objects.filter(**{'path__' + lookup: value}).order_by().explain()
+                self.assertIn('simplenode_path_gist', plan)
+
+    def test_depth_index_used(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+        # The depth transform compiles to NLEVEL(path), which the expression index covers
+        plan = SimpleNode.objects.filter(path__depth=2).order_by().explain()
+        self.assertIn('test_app_simplenode_depth_idx', plan)
+
+
+# Checks that don't need the database belong here, so they skip TestCase's transaction handling
+class TestLookupRegistration(SimpleTestCase):
+
+    def test_lookups_registered(self):
+        lookups = LTreeField.get_lookups()
+
+        for lookup_name in [
+            'ancestor_of', 'descendant_of', 'sibling_of', 'child_of', 'parent_of', 'matches', 'search', 'depth'
+        ]:
+            with self.subTest(lookup_name=lookup_name):
+                self.assertIn(lookup_name, lookups)
+
+    def test_index_and_slice_transforms(self):
+        field = LTreeField()
 
-    def tearDown(self):
-        pass
+        self.assertIs(field.get_transform('0').func, IndexTransform)
+        self.assertIs(field.get_transform('0_2').func, SliceTransform)
+        self.assertIsNone(field.get_transform('0_1_2'))
+        self.assertIsNone(field.get_transform('not_a_transform'))